@@ -1,12 +1,51 @@
 import os
+from dataclasses import MISSING, dataclass, field, fields
 from pathlib import Path
-from typing import Any, Dict, List, Optional
-
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Optional,
+    Pattern,
+    Tuple,
+)
+
+import msgspec
 import yaml
-from pydantic import BaseModel
 
+try:
+    _LOADER = yaml.CSafeLoader
+except AttributeError:  # PyYAML built without libyaml
+    _LOADER = yaml.SafeLoader
+
+
+def _state(**kwargs):
+    # Runtime state filled in by the proxy server, not read from the config file
+    return field(init=False, repr=False, compare=False, **kwargs)
+
+
+def reset_state(obj) -> None:
+    # Restore every _state field of obj to its default
+    for f in fields(obj):
+        if not f.init:
+            if f.default_factory is not MISSING:
+                setattr(obj, f.name, f.default_factory())
+            else:
+                setattr(obj, f.name, f.default)
+
+
+def _drop_state_keys(data) -> None:
+    # msgspec would decode _state fields too, so strip them from the input
+    if isinstance(data, dict):
+        for key in [k for k in data if isinstance(k, str) and k.startswith("_")]:
+            del data[key]
 
-class FailureCondition(BaseModel):
+
+@dataclass(slots=True)
+class FailureCondition:
     enabled: bool = True
     method: Optional[str] = None
     count: Optional[int] = None
@@ -15,32 +54,60 @@ class FailureCondition(BaseModel):
     delay: Optional[int] = None
 
 
-class FailureResponse(BaseModel):
+@dataclass(slots=True)
+class FailureResponse:
     status_code: int
     body: Optional[Dict[str, Any]] = None
     headers: Optional[Dict[str, str]] = None
 
 
-class FailureRule(BaseModel):
+@dataclass(slots=True)
+class FailureRule:
     condition: FailureCondition
     response: FailureResponse
 
+    # Builds the injected response; prepared by the proxy server at config load
+    _response_factory: Optional[Callable[[], Any]] = _state(default=None)
+
+    # Request counters per (method, path), kept by the failure injector
+    _counters: Dict[Tuple[str, str], Iterator[int]] = _state(default_factory=dict)
+
 
-class Endpoint(BaseModel):
+@dataclass(slots=True)
+class Endpoint:
     path: str
     methods: List[str]
     debug: bool = False
-    failure_rules: List[FailureRule] = []
+    failure_rules: List[FailureRule] = field(default_factory=list)
 
+    # Matching state precompiled by the proxy server when the config is loaded
+    _index: int = _state(default=0)
+    _match_all: bool = _state(default=False)
+    _pattern: Optional[Pattern[str]] = _state(default=None)
+    _any_method: bool = _state(default=False)
+    _methods_upper: FrozenSet[str] = _state(default=frozenset())
 
-class Target(BaseModel):
+
+@dataclass(slots=True)
+class Target:
     url: str
     path_prefix: Optional[str] = None
     headers: Optional[Dict[str, str]] = None
-    endpoints: List[Endpoint] = []
+    endpoints: List[Endpoint] = field(default_factory=list)
+
+    # Request state precompiled by the proxy server when the config is loaded
+    _origin: Tuple[bytes, bytes, Optional[int]] = _state(default=(b"", b"", None))
+    _path_prefix: bytes = _state(default=b"")
+    _origin_url: str = _state(default="")
+    _raw_headers: List[Tuple[bytes, bytes]] = _state(default_factory=list)
+    _drop_headers: FrozenSet[bytes] = _state(default=frozenset())
+    _literal_endpoints: Dict[str, List[Endpoint]] = _state(default_factory=dict)
+    _wildcard_endpoints: List[Endpoint] = _state(default_factory=list)
+    _lookup: Optional[Callable[[str, str], Optional[Endpoint]]] = _state(default=None)
 
 
-class ServerConfig(BaseModel):
+@dataclass(slots=True)
+class ServerConfig:
     host: str = "0.0.0.0"
     port: int = 8000
     debug: bool = False
@@ -48,12 +115,14 @@ class ServerConfig(BaseModel):
     limit_concurrency: Optional[int] = None
 
 
-class LoggingConfig(BaseModel):
+@dataclass(slots=True)
+class LoggingConfig:
     level: str = "INFO"
     format: str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 
 
-class ProxyConfig(BaseModel):
+@dataclass(slots=True)
+class ProxyConfig:
     server: ServerConfig
     logging: LoggingConfig
     target: Target
@@ -64,8 +133,9 @@ def load_config(config_path: str = "config.yaml") -> ProxyConfig:
     if not config_file.exists():
         raise FileNotFoundError(f"Configuration file {config_path} not found")
 
-    with open(config_file, "r") as f:
-        config_data = yaml.safe_load(f)
+    # Hand libyaml the raw bytes so it decodes the document itself instead of
+    # pulling re-encoded chunks from a text-mode file object
+    config_data = yaml.load(config_file.read_bytes(), Loader=_LOADER)  # nosec B506
 
     # Expand environment variables in headers
     target_data = config_data.get("target", {})
@@ -79,4 +149,12 @@ def load_config(config_path: str = "config.yaml") -> ProxyConfig:
                 env_var = value[2:-1]
                 target_data["headers"][key] = os.getenv(env_var, value)
 
-    return ProxyConfig(**config_data)
+    # Only the models carrying runtime state; bodies and headers stay untouched
+    _drop_state_keys(target_data)
+    for endpoint_data in target_data.get("endpoints") or []:
+        _drop_state_keys(endpoint_data)
+        if isinstance(endpoint_data, dict):
+            for rule_data in endpoint_data.get("failure_rules") or []:
+                _drop_state_keys(rule_data)
+
+    return msgspec.convert(config_data, type=ProxyConfig, strict=False)
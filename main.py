@@ -1,41 +1,114 @@
 import argparse
 import asyncio
+import contextlib
+import functools
+import itertools
+import json
 import logging
 import random
 import re
 import sys
 import threading
-from collections import defaultdict
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Optional
 
-import httpx
+import httpcore
 import uvicorn
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse, Response
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
-from config import Endpoint, FailureRule, ProxyConfig, load_config
+from config import Endpoint, FailureRule, ProxyConfig, Target, load_config, reset_state
+
+# Per-request timeouts for the backend, matching the httpx client defaults
+BACKEND_EXTENSIONS = {
+    "timeout": {"connect": 5.0, "read": 5.0, "write": 5.0, "pool": 5.0}
+}
+
+# The body is relayed still encoded and the server re-frames the message, so
+# only the framing header is dropped from backend responses
+DROP_RESPONSE_HEADERS = frozenset([b"transfer-encoding"])
+
+# Failures talking to the backend that are reported as 502 Bad Gateway
+BACKEND_ERRORS = (
+    httpcore.NetworkError,
+    httpcore.ProtocolError,
+    httpcore.TimeoutException,
+    httpcore.UnsupportedProtocol,
+)
 
 
 class ConfigReloadHandler(FileSystemEventHandler):
-    def __init__(self, proxy_server, config_path: str):
+    def __init__(self, proxy_server, config_path: str, debounce: float = 0.2):
         self.proxy_server = proxy_server
         self.config_path = Path(config_path).resolve()
+        self._debounce = debounce
+        self._timer: Optional[threading.Timer] = None
 
     def on_modified(self, event):
         if event.is_directory:
             return
 
         if Path(event.src_path).resolve() == self.config_path:
-            self.proxy_server.reload_config()
+            # Editors emit several events per save; only reload once the
+            # burst has settled
+            if self._timer:
+                self._timer.cancel()
+            self._timer = threading.Timer(
+                self._debounce, self.proxy_server.schedule_reload
+            )
+            self._timer.daemon = True
+            self._timer.start()
 
 
-class FailureInjector:
-    def __init__(self):
-        self.request_counts: Dict[str, int] = defaultdict(int)
+def _decode_header(value) -> str:
+    return value.decode("latin-1") if isinstance(value, bytes) else value
+
+
+def _decode_content(content: bytes, encoding: bytes) -> Optional[bytes]:
+    # Undo the content codings (applied in listed order) for logging only;
+    # None means one of them is not supported
+    for coding in reversed(encoding.lower().split(b",")):
+        coding = coding.strip()
+        if coding in (b"gzip", b"x-gzip"):
+            content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+        elif coding == b"deflate":
+            try:
+                content = zlib.decompress(content)
+            except zlib.error:
+                # Some servers send raw deflate data without the zlib wrapper
+                content = zlib.decompress(content, -zlib.MAX_WBITS)
+        elif coding not in (b"", b"identity"):
+            return None
+    return content
+
 
+# Formats header pairs one per line, but only once a log record is emitted
+class _HeaderFormatter:
+    def __init__(self, items):
+        self.items = items
+
+    def __str__(self) -> str:
+        return "\n".join(
+            f"    {_decode_header(k)}: {_decode_header(v)}" for k, v in self.items
+        )
+
+
+# Response whose body and raw headers were rendered ahead of time
+class _PrerenderedResponse(Response):
+    def __init__(self, body: bytes, status_code: int, raw_headers: list):
+        self.body = body
+        self.status_code = status_code
+        self.background = None
+        # Copied so middleware appending headers cannot alter the template
+        self.raw_headers = list(raw_headers)
+
+
+class FailureInjector:
     def should_inject_failure(self, rule: FailureRule, method: str, path: str) -> bool:
         condition = rule.condition
 
@@ -43,19 +116,26 @@ class FailureInjector:
         if not condition.enabled:
             return False
 
-        if condition.method and condition.method.upper() != method.upper():
+        if condition.method and condition.method != method:
             return False
 
-        key = f"{method}:{path}"
-        self.request_counts[key] += 1
+        # Only count/every need the request number, so rules without them
+        # skip the counter bookkeeping entirely
+        if condition.count or condition.every:
+            # Each rule counts its own requests, still scoped per method and path
+            key = (method, path)
+            counter = rule._counters.get(key)
+            if counter is None:
+                counter = rule._counters.setdefault(key, itertools.count(1))
+            request_count = next(counter)
 
-        if condition.count:
-            if self.request_counts[key] != condition.count:
-                return False
+            if condition.count:
+                if request_count != condition.count:
+                    return False
 
-        if condition.every:
-            if self.request_counts[key] % condition.every != 0:
-                return False
+            if condition.every:
+                if request_count % condition.every != 0:
+                    return False
 
         if condition.probability:
             if random.random() > condition.probability:
@@ -66,17 +146,39 @@ class FailureInjector:
 
 class ProxyServer:
     def __init__(self, config: ProxyConfig, config_path: str = "config.yaml"):
-        self.config = config
+        self.config = self._prepare_config(config)
         self.config_path = config_path
-        self.config_lock = threading.RLock()
-        self.app = FastAPI(title="Debug Proxy Server", debug=config.server.debug)
-        self.client = httpx.AsyncClient()
+        self.app = FastAPI(
+            title="Debug Proxy Server",
+            debug=config.server.debug,
+            lifespan=self._lifespan,
+        )
+        self.client: Optional[httpcore.AsyncConnectionPool] = None
         self.failure_injector = FailureInjector()
         self.logger = self._setup_logging()
         self.observer = None
+        # Reloads run one at a time, so an older parse can never be published
+        # after a newer one
+        self._reload_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="config-reload"
+        )
         self._setup_routes()
         self._setup_config_watcher()
 
+    @contextlib.asynccontextmanager
+    async def _lifespan(self, app: FastAPI):
+        # Create the connection pool inside the server's event loop, sized for
+        # proxy fan-in, and close its pooled connections on shutdown
+        async with httpcore.AsyncConnectionPool(
+            max_connections=1000,
+            max_keepalive_connections=500,
+            keepalive_expiry=30,
+            http2=True,
+        ) as client:
+            self.client = client
+            yield
+        self.client = None
+
     def _setup_logging(self) -> logging.Logger:
         logging.basicConfig(
             level=getattr(logging, self.config.logging.level),
@@ -95,19 +197,104 @@ class ProxyServer:
             self.observer.start()
             self.logger.info(f"Config file watcher started for {self.config_path}")
 
+    def schedule_reload(self):
+        self._reload_executor.submit(self.reload_config)
+
     def reload_config(self):
         try:
-            with self.config_lock:
-                new_config = load_config(self.config_path)
-                self.config = new_config
-                self.logger.info("Configuration reloaded successfully")
+            new_config = self._prepare_config(load_config(self.config_path))
+
+            # Publish the fully built config with a single rebind; request
+            # handlers snapshot self.config once and never see a partial swap
+            old_config, self.config = self.config, new_config
+            old_config.target._lookup.cache_clear()
+            self.logger.info("Configuration reloaded successfully")
 
-                # Update logging level if changed
-                self.logger.setLevel(getattr(logging, new_config.logging.level))
+            # Update logging level if changed
+            self.logger.setLevel(getattr(logging, new_config.logging.level))
 
         except Exception as e:
             self.logger.error(f"Failed to reload configuration: {e}")
 
+    def _prepare_config(self, config: ProxyConfig) -> ProxyConfig:
+        target = config.target
+        reset_state(target)
+        for endpoint in target.endpoints:
+            reset_state(endpoint)
+            for rule in endpoint.failure_rules:
+                reset_state(rule)
+
+        # Backend origin and path prefix, ready to have the request path appended
+        base_url = target.url.rstrip("/")
+        if target.path_prefix:
+            # Ensure path_prefix starts with / and doesn't end with /
+            base_url += "/" + target.path_prefix.strip("/")
+        url = httpcore.URL(base_url)
+        target._origin = (url.scheme, url.host, url.port)
+        target._path_prefix = url.target.rstrip(b"/")
+        # IPv6 literals need their brackets back in the Host header and URL
+        netloc = b"[%s]" % url.host if b":" in url.host else url.host
+        if url.port is not None:
+            netloc += b":%d" % url.port
+        target._origin_url = (url.scheme + b"://" + netloc).decode("latin-1")
+
+        # Configured headers replace any client header of the same name
+        target._raw_headers = [
+            (k.lower().encode("latin-1"), v.encode("latin-1"))
+            for k, v in (target.headers or {}).items()
+        ]
+        if not any(k == b"host" for k, _ in target._raw_headers):
+            target._raw_headers.insert(0, (b"host", netloc))
+        target._drop_headers = frozenset(
+            [b"host"] + [k for k, _ in target._raw_headers]
+        )
+
+        for index, endpoint in enumerate(target.endpoints):
+            pattern = endpoint.path
+            endpoint._index = index
+            endpoint._match_all = pattern == "/*"
+            if "*" in pattern and not endpoint._match_all:
+                endpoint._pattern = re.compile("^" + pattern.replace("*", ".*") + "$")
+            endpoint._methods_upper = frozenset(m.upper() for m in endpoint.methods)
+            endpoint._any_method = "*" in endpoint._methods_upper
+
+            for rule in endpoint.failure_rules:
+                # Compared as-is against the (always upper-case) request method
+                if rule.condition.method:
+                    rule.condition.method = rule.condition.method.upper()
+
+                # Failure responses are static, so render body and headers once
+                template = Response(
+                    content=json.dumps(
+                        rule.response.body or {},
+                        ensure_ascii=False,
+                        allow_nan=False,
+                        separators=(",", ":"),
+                    ).encode("utf-8"),
+                    status_code=rule.response.status_code,
+                    headers=rule.response.headers or {},
+                    media_type="application/json",
+                )
+                rule._response_factory = functools.partial(
+                    _PrerenderedResponse,
+                    template.body,
+                    template.status_code,
+                    template.raw_headers,
+                )
+
+            if "*" in pattern:
+                target._wildcard_endpoints.append(endpoint)
+            else:
+                target._literal_endpoints.setdefault(pattern, []).append(endpoint)
+
+        # Matching is a pure function of the target, so memoize it per config;
+        # a reload swaps in a fresh cache along with the new endpoints
+        target._lookup = functools.lru_cache(maxsize=4096)(
+            functools.partial(self._find_matching_endpoint, target)
+        )
+
+        return config
+
     def _setup_routes(self):
         @self.app.api_route(
             "/{full_path:path}",
@@ -116,52 +303,52 @@ class ProxyServer:
         async def proxy_handler(request: Request, full_path: str):
             return await self._handle_request(request, full_path)
 
-    def _find_matching_endpoint(self, path: str, method: str) -> Optional[Endpoint]:
-        with self.config_lock:
-            for endpoint in self.config.target.endpoints:
-                if self._path_matches(endpoint.path, path) and self._method_matches(
-                    endpoint.methods, method
-                ):
-                    return endpoint
-            return None
-
-    def _path_matches(self, pattern: str, path: str) -> bool:
-        if pattern == "/*":
-            return True
-
-        if "*" in pattern:
-            regex_pattern = pattern.replace("*", ".*")
-            return bool(re.match(f"^{regex_pattern}$", path))
-
-        return pattern == path
-
-    def _method_matches(self, allowed_methods: list, method: str) -> bool:
-        return "*" in allowed_methods or method.upper() in [
-            m.upper() for m in allowed_methods
-        ]
+    def _find_matching_endpoint(
+        self, target: Target, path: str, method: str
+    ) -> Optional[Endpoint]:
+        # The route only accepts upper-case methods, so no normalization here
+        match = None
+        for endpoint in target._literal_endpoints.get(path, ()):
+            if endpoint._any_method or method in endpoint._methods_upper:
+                match = endpoint
+                break
+
+        # A wildcard endpoint only wins if it is declared before the literal
+        # match, so first-match-in-config-order semantics are preserved
+        limit = match._index if match else len(target.endpoints)
+        for endpoint in target._wildcard_endpoints:
+            if endpoint._index >= limit:
+                break
+            if not endpoint._match_all and not endpoint._pattern.match(path):
+                continue
+            if endpoint._any_method or method in endpoint._methods_upper:
+                return endpoint
+
+        return match
 
     async def _handle_request(self, request: Request, full_path: str):
         path = f"/{full_path}"
         method = request.method
 
-        endpoint = self._find_matching_endpoint(path, method)
         target = self.config.target
+        endpoint = target._lookup(path, method)
 
         if not endpoint:
             raise HTTPException(status_code=404, detail="No matching endpoint found")
 
-        # Read request body early for logging and later use
-        body = await request.body()
+        debug = endpoint.debug
 
         # Log request details immediately, before any failure injection
-        if endpoint and endpoint.debug:
+        if debug:
+            # Buffer the body so it can be logged before being forwarded
+            body = await request.body()
+
             self.logger.info(f"[proxy] {method} {path} -> {target.url}")
 
             # Log request headers
-            headers_str = "\n".join(
-                [f"    {k}: {v}" for k, v in request.headers.items()]
+            self.logger.info(
+                "[proxy] Request headers:\n%s", _HeaderFormatter(request.headers.raw)
             )
-            self.logger.info(f"[proxy] Request headers:\n{headers_str}")
 
             # Log request body if present
             if body:
@@ -178,105 +365,141 @@ class ProxyServer:
                     )
             else:
                 self.logger.info("[proxy] Request body: <empty>")
+        elif "content-length" in request.headers or (
+            "transfer-encoding" in request.headers
+        ):
+            # Stream the body through to the backend without buffering it
+            body = request.stream()
+        else:
+            body = None
 
         # Check for failure injection after logging
-        if endpoint:
-            for rule in endpoint.failure_rules:
-                if self.failure_injector.should_inject_failure(rule, method, path):
-                    # Handle delay asynchronously if specified
-                    if rule.condition.delay:
-                        self.logger.info(
-                            f"[proxy] Delaying response by {rule.condition.delay}ms"
-                        )
-                        await asyncio.sleep(rule.condition.delay / 1000.0)
-
-                    self.logger.warning(
-                        f"[proxy] Injecting failure for {method} {path}: {rule.response.status_code}"
-                    )
-                    return JSONResponse(
-                        status_code=rule.response.status_code,
-                        content=rule.response.body or {},
-                        headers=rule.response.headers or {},
+        for rule in endpoint.failure_rules:
+            if self.failure_injector.should_inject_failure(rule, method, path):
+                # Handle delay asynchronously if specified
+                if rule.condition.delay:
+                    self.logger.info(
+                        f"[proxy] Delaying response by {rule.condition.delay}ms"
                     )
+                    await asyncio.sleep(rule.condition.delay / 1000.0)
 
-        headers = dict(request.headers)
+                self.logger.warning(
+                    f"[proxy] Injecting failure for {method} {path}: {rule.response.status_code}"
+                )
+                return rule._response_factory()
 
-        if target.headers:
-            headers.update(target.headers)
+        # Forward raw client headers minus host and anything the target overrides
+        drop_headers = target._drop_headers
+        headers = [
+            (k, v) for k, v in request.headers.raw if k not in drop_headers
+        ] + target._raw_headers
 
-        # Remove host header to avoid conflicts
-        headers.pop("host", None)
+        # Forward the still-encoded path and query string untouched
+        request_target = target._path_prefix + request.scope["raw_path"]
+        query_string = request.scope.get("query_string")
+        if query_string:
+            request_target += b"?" + query_string
 
-        # Construct target URL with optional path prefix
-        if target.path_prefix:
-            # Ensure path_prefix starts with / and doesn't end with /
-            prefix = target.path_prefix.strip("/")
-            target_url = f"{target.url.rstrip('/')}/{prefix}{path}"
-        else:
-            target_url = f"{target.url.rstrip('/')}{path}"
+        scheme, host, port = target._origin
+        url = httpcore.URL(scheme=scheme, host=host, port=port, target=request_target)
 
         # Log actual request being sent to backend (after header modifications)
-        if endpoint and endpoint.debug:
-            self.logger.info(f"[proxy] Sending to backend: {method} {target_url}")
+        if debug:
+            self.logger.info(
+                "[proxy] Sending to backend: %s %s%s",
+                method,
+                target._origin_url,
+                request_target.decode("latin-1"),
+            )
 
             # Log final headers that will be sent
-            final_headers_str = "\n".join([f"    {k}: {v}" for k, v in headers.items()])
-            self.logger.info(f"[proxy] Final request headers:\n{final_headers_str}")
+            self.logger.info(
+                "[proxy] Final request headers:\n%s", _HeaderFormatter(headers)
+            )
 
             # Log query parameters if any
             if request.query_params:
-                params_str = "\n".join(
-                    [f"    {k}: {v}" for k, v in request.query_params.items()]
+                self.logger.info(
+                    "[proxy] Query parameters:\n%s",
+                    _HeaderFormatter(request.query_params.multi_items()),
                 )
-                self.logger.info(f"[proxy] Query parameters:\n{params_str}")
 
         try:
-            response = await self.client.request(
-                method=method,
-                url=target_url,
-                headers=headers,
-                content=body,
-                params=dict(request.query_params),
+            response = await self.client.handle_async_request(
+                httpcore.Request(
+                    method,
+                    url,
+                    headers=headers,
+                    content=body,
+                    extensions=BACKEND_EXTENSIONS,
+                )
             )
+        except BACKEND_ERRORS as e:
+            self.logger.error(f"[proxy] Request failed: {e}")
+            raise HTTPException(status_code=502, detail=f"Bad Gateway: {str(e)}")
 
-            if endpoint and endpoint.debug:
-                self.logger.info(f"[proxy] Response: {response.status_code}")
+        # Relay backend headers raw in a single pass; ASGI wants lower-case names
+        response_headers = [
+            (name, value)
+            for key, value in response.headers
+            if (name := key.lower()) not in DROP_RESPONSE_HEADERS
+        ]
 
-                # Log response headers
-                resp_headers_str = "\n".join(
-                    [f"    {k}: {v}" for k, v in response.headers.items()]
-                )
-                self.logger.info(f"[proxy] Response headers:\n{resp_headers_str}")
-
-                # Log response body if present
-                if response.content:
-                    try:
-                        # Try to decode as UTF-8 text
-                        resp_body_str = response.content.decode("utf-8")
-                        # Truncate very long bodies
-                        if len(resp_body_str) > 1000:
-                            resp_body_str = resp_body_str[:1000] + "... (truncated)"
-                        self.logger.info(f"[proxy] Response body:\n{resp_body_str}")
-                    except UnicodeDecodeError:
-                        self.logger.info(
-                            f"[proxy] Response body: <binary data, {len(response.content)} bytes>"
-                        )
-
-            response_headers = dict(response.headers)
-            response_headers.pop("content-encoding", None)
-            response_headers.pop("transfer-encoding", None)
-            response_headers.pop("content-length", None)
-
-            return Response(
-                content=response.content,
-                status_code=response.status_code,
-                headers=response_headers,
-                media_type=response.headers.get("content-type"),
+        if not debug:
+            # Relay the body as it arrives and release the connection after
+            streaming_response = StreamingResponse(
+                response.aiter_stream(),
+                status_code=response.status,
+                background=BackgroundTask(response.aclose),
             )
+            streaming_response.raw_headers = response_headers
+            return streaming_response
 
-        except httpx.RequestError as e:
+        try:
+            content = await response.aread()
+        except BACKEND_ERRORS as e:
             self.logger.error(f"[proxy] Request failed: {e}")
             raise HTTPException(status_code=502, detail=f"Bad Gateway: {str(e)}")
+        finally:
+            await response.aclose()
+
+        self.logger.info(f"[proxy] Response: {response.status}")
+
+        # Log response headers
+        self.logger.info(
+            "[proxy] Response headers:\n%s", _HeaderFormatter(response.headers)
+        )
+
+        # Log response body if present, decoding a copy if it is compressed
+        content_encoding = next(
+            (v for k, v in response_headers if k == b"content-encoding"), b""
+        )
+        try:
+            log_content = _decode_content(content, content_encoding)
+        except zlib.error:
+            log_content = None
+
+        if content and log_content is None:
+            self.logger.info(
+                f"[proxy] Response body: <{content_encoding.decode('latin-1')} "
+                f"encoded data, {len(content)} bytes>"
+            )
+        elif content:
+            try:
+                # Try to decode as UTF-8 text
+                resp_body_str = log_content.decode("utf-8")
+                # Truncate very long bodies
+                if len(resp_body_str) > 1000:
+                    resp_body_str = resp_body_str[:1000] + "... (truncated)"
+                self.logger.info(f"[proxy] Response body:\n{resp_body_str}")
+            except UnicodeDecodeError:
+                self.logger.info(
+                    f"[proxy] Response body: <binary data, {len(log_content)} bytes>"
+                )
+
+        proxy_response = Response(content=content, status_code=response.status)
+        proxy_response.raw_headers = response_headers
+        return proxy_response
 
     def run(self):
         try:
@@ -311,6 +534,7 @@ class ProxyServer:
             if self.observer:
                 self.observer.stop()
                 self.observer.join()
+            self._reload_executor.shutdown(wait=False, cancel_futures=True)
 
 
 def main():